@@ -10,6 +10,12 @@ import streamlit as st
 from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from concurrency_config import load_concurrency_config
+from hedging import get_hedge_policy
+from prompt_budget import DEFAULT_MODEL_PATH, get_prompt_budget
+from tournament import DEFAULT_CHUNK_SIZE, TournamentDraw
+from traffic_capture import get_recorder
+
 # ロギングの設定
 logging.basicConfig(
     level=logging.INFO,
@@ -34,6 +40,44 @@ class BedrockModelInvoker:
         
         self.model_arn = config['model_arn']
 
+        # キャプチャ設定（capture_path が指定された場合のみ有効）
+        self.recorder = None
+        if config.get('capture_path'):
+            self.recorder = get_recorder(
+                config['capture_path'],
+                sample_rate=config.get('capture_sample_rate', 1.0)
+            )
+
+        # ヘッジ設定（hedge_percentile が指定された場合のみ有効）
+        self.hedge_policy = None
+        self.hedge_model_arn = config.get('hedge_model_arn')
+        if config.get('hedge_percentile'):
+            self.hedge_policy = get_hedge_policy(
+                self.model_arn,
+                hedge_percentile=config['hedge_percentile'],
+                budget=config.get('hedge_budget', 0.1)
+            )
+
+    def _invoke_endpoint(self, model_arn, body):
+        """指定したモデル ARN にリクエストを送信"""
+        return self.bedrock_runtime.invoke_model(
+            modelId=model_arn,
+            body=body,
+            contentType="application/json",
+            accept="application/json"
+        )
+
+    def _send(self, request_body):
+        """ヘッジが有効な場合は、遅いリクエストをヘッジしながら送信"""
+        body = json.dumps(request_body)
+        if self.hedge_policy is None:
+            return self._invoke_endpoint(self.model_arn, body)
+        return self.hedge_policy.run(
+            lambda model_arn: self._invoke_endpoint(model_arn, body),
+            self.model_arn,
+            self.hedge_model_arn
+        )
+
     def invoke_model(self, prompt, max_tokens=100, temperature=0.7):
         try:
             request_body = {
@@ -42,14 +86,24 @@ class BedrockModelInvoker:
                 "temperature": temperature
             }
 
+            sampled = self.recorder is not None and self.recorder.should_sample()
+            status = 'error'
             start_time = time.time()
-            response = self.bedrock_runtime.invoke_model(
-                modelId=self.model_arn,
-                body=json.dumps(request_body),
-                contentType="application/json",
-                accept="application/json"
-            )
-            end_time = time.time()
+            try:
+                response = self._send(request_body)
+                status = 'ok'
+            finally:
+                end_time = time.time()
+                if sampled:
+                    self.recorder.record({
+                        'ts': start_time,
+                        'model': self.model_arn,
+                        'prompt': prompt,
+                        'max_tokens': max_tokens,
+                        'temperature': temperature,
+                        'latency': end_time - start_time,
+                        'status': status
+                    })
             
             response_body = json.loads(response['body'].read().decode('utf-8'))
             logger.info(f"Response time is {end_time - start_time:.3f} sec")
@@ -74,29 +128,6 @@ class BedrockModelInvoker:
             logger.error(f"Error invoking model: {str(e)}")
             raise
 
-def create_prompt(names):
-    """
-    名前のリストからプロンプトを生成
-    """
-    names_list = "\n".join([f"- {name.strip()}" for name in names if name.strip()])
-    
-    prompt = f"""あなたは、抽選を行うロボットです。下記リストの中から、ランダムな形で人を選び、それを出力してください。
-出力形式は下記のフォーマットのjsonでお願いします。jsonのみ出力してください。
-[LIST]
-{names_list}
-[/LIST]
-[FORMAT]
-{{
-  "name": {{
-    "type": "string",
-    "description": "抽選された人の名前（フルネーム）"
-  }}
-}}
-[/FORMAT]"""
-    
-    return f"[INST]{prompt}[/INST]"
-
-
 def parse_arguments():
     """コマンドライン引数のパース"""
     parser = argparse.ArgumentParser(
@@ -116,6 +147,62 @@ def parse_arguments():
         default='us-west-2',
         help='Region of imported model.'
     )
+
+    parser.add_argument(
+        '--capture-path',
+        type=str,
+        default=None,
+        help='Append requests to this capture file for later replay (default: disabled)'
+    )
+
+    parser.add_argument(
+        '--capture-sample-rate',
+        type=float,
+        default=1.0,
+        help='Fraction of requests to capture (default: 1.0)'
+    )
+
+    parser.add_argument(
+        '--concurrency-config',
+        type=str,
+        default=None,
+        help='Recommended concurrency config written by tune_concurrency.py (optional)'
+    )
+
+    parser.add_argument(
+        '--hedge-percentile',
+        type=float,
+        default=None,
+        help='Send a hedged request when a request exceeds this latency percentile, e.g. 95 (default: disabled)'
+    )
+
+    parser.add_argument(
+        '--hedge-budget',
+        type=float,
+        default=0.1,
+        help='Maximum fraction of requests that may be hedged (default: 0.1)'
+    )
+
+    parser.add_argument(
+        '--hedge-model-arn',
+        type=str,
+        default=None,
+        help='Imported Model ARN to send hedged requests to (default: same as --model-arn)'
+    )
+
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f'Maximum number of participants in one draw prompt (default: {DEFAULT_CHUNK_SIZE})'
+    )
+
+    parser.add_argument(
+        '--tokenizer-path',
+        type=str,
+        default=DEFAULT_MODEL_PATH,
+        help=f'Local model directory with tokenizer.json and config.json (default: {DEFAULT_MODEL_PATH})'
+    )
     
     
     return parser.parse_args()
@@ -133,10 +220,16 @@ def main():
     st.markdown("### This model is hosted on **Amazon Bedrock Custom Model Import**.")
     
     # モデル設定
+    concurrency_config = load_concurrency_config(args.concurrency_config)
     model_config = {
         'region_name': args.region,
         'model_arn': args.model_arn,
-        'max_retries': 30
+        'max_retries': concurrency_config['max_retries'] or 30,
+        'capture_path': args.capture_path,
+        'capture_sample_rate': args.capture_sample_rate,
+        'hedge_percentile': args.hedge_percentile,
+        'hedge_budget': args.hedge_budget,
+        'hedge_model_arn': args.hedge_model_arn
     }
 
     # 名前入力エリア
@@ -161,18 +254,21 @@ def main():
 
         try:
             with st.spinner("抽選中..."):
-                # プロンプトの生成と抽選実行
-                prompt = create_prompt(names)
+                # 抽選実行（参加者が多い場合はグループに分けて並列に抽選）
                 invoker = BedrockModelInvoker(model_config)
-                result = invoker.invoke_model(
-                    prompt=prompt,
-                    max_tokens=256,
-                    temperature=0.7
+                draw = TournamentDraw(
+                    invoker,
+                    chunk_size=args.chunk_size,
+                    max_workers=concurrency_config['max_concurrency'] if args.concurrency_config else 8,
+                    temperature=0.7,
+                    rate_limit=concurrency_config['rate_limit'],
+                    # プロンプトのトークン数からグループの大きさと max_tokens を決める
+                    budget=get_prompt_budget(args.tokenizer_path)
                 )
+                result = draw.draw(names)
 
                 # 結果の表示
-                result_json = json.loads(result.get("outputs")[0].get("text"))
-                if isinstance(result_json, dict) and 'name' in result_json:
+                if result.get('name'):
                     st.balloons()  # 視覚効果
                     st.success("抽選が完了しました！")
                     
@@ -182,13 +278,23 @@ def main():
                         <h2 style='color: #0066cc;'>当選者</h2>
                         <h1 style='color: #333333;'>{}</h1>
                     </div>
-                    """.format(result_json['name']), unsafe_allow_html=True)
-                    st.markdown(f"LLM からの返答内容: {result}")
+                    """.format(result['name']), unsafe_allow_html=True)
+                    st.markdown(f"参加者数: {len(names)} / ラウンドごとのグループ数: {result['rounds']}")
+                    if result['fallbacks']:
+                        st.warning(
+                            f"{result['fallbacks']} グループでモデルの抽選に失敗したため、"
+                            "人数に応じた乱数で抽選しました"
+                        )
                     
                 else:
                     st.error("抽選結果の解析に失敗しました")
                     logger.error(f"Unexpected response format: {result}")
 
+                # ヘッジの統計値（ヘッジ率・短縮できた時間）
+                if invoker.hedge_policy is not None:
+                    with st.expander("📊 ヘッジ統計"):
+                        st.json(invoker.hedge_policy.stats())
+
         except Exception as e:
             st.error(f"エラーが発生しました: {str(e)}")
             logger.error(f"Error during lottery: {str(e)}")
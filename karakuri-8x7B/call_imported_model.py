@@ -2,11 +2,17 @@ import argparse
 import json
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from concurrency_config import RateLimiter, load_concurrency_config
+from hedging import get_hedge_policy
+from prompt_budget import DEFAULT_MODEL_PATH, get_prompt_budget
+from traffic_capture import get_recorder
+
 # ロギングの設定
 logging.basicConfig(
     level=logging.INFO,
@@ -15,9 +21,10 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class BedrockModelInvoker:
-    def __init__(self, config):
+    def __init__(self, config, bedrock_runtime=None):
         """
         :param config: 設定値を含む辞書
+        :param bedrock_runtime: 使用する Bedrock Runtime クライアント（動作確認用のスタブなど。省略時は boto3 で作成）
         """
         # リトライ設定を含むboto3の設定
         boto3_config = Config(
@@ -28,7 +35,7 @@ class BedrockModelInvoker:
         )
         
         # Bedrock Runtimeクライアントの初期化
-        self.bedrock_runtime = boto3.client(
+        self.bedrock_runtime = bedrock_runtime or boto3.client(
             service_name='bedrock-runtime',
             region_name=config['region_name'],
             config=boto3_config
@@ -36,6 +43,44 @@ class BedrockModelInvoker:
         
         self.model_arn = config['model_arn']
 
+        # キャプチャ設定（capture_path が指定された場合のみ有効）
+        self.recorder = None
+        if config.get('capture_path'):
+            self.recorder = get_recorder(
+                config['capture_path'],
+                sample_rate=config.get('capture_sample_rate', 1.0)
+            )
+
+        # ヘッジ設定（hedge_percentile が指定された場合のみ有効）
+        self.hedge_policy = None
+        self.hedge_model_arn = config.get('hedge_model_arn')
+        if config.get('hedge_percentile'):
+            self.hedge_policy = get_hedge_policy(
+                self.model_arn,
+                hedge_percentile=config['hedge_percentile'],
+                budget=config.get('hedge_budget', 0.1)
+            )
+
+    def _invoke_endpoint(self, model_arn, body):
+        """指定したモデル ARN にリクエストを送信"""
+        return self.bedrock_runtime.invoke_model(
+            modelId=model_arn,
+            body=body,
+            contentType="application/json",
+            accept="application/json"
+        )
+
+    def _send(self, request_body):
+        """ヘッジが有効な場合は、遅いリクエストをヘッジしながら送信"""
+        body = json.dumps(request_body)
+        if self.hedge_policy is None:
+            return self._invoke_endpoint(self.model_arn, body)
+        return self.hedge_policy.run(
+            lambda model_arn: self._invoke_endpoint(model_arn, body),
+            self.model_arn,
+            self.hedge_model_arn
+        )
+
     def invoke_model(self, prompt, max_tokens=100, temperature=0.7):
         """
         モデルを呼び出して推論を実行
@@ -55,14 +100,24 @@ class BedrockModelInvoker:
 
             # モデルの呼び出し
             logger.info(f"Invoking model with prompt: {prompt[:100]}...")  # プロンプトの先頭100文字のみログ出力
+            sampled = self.recorder is not None and self.recorder.should_sample()
+            status = 'error'
             start_time = time.time()
-            response = self.bedrock_runtime.invoke_model(
-                modelId=self.model_arn,
-                body=json.dumps(request_body),
-                contentType="application/json",
-                accept="application/json"
-            )
-            end_time = time.time()
+            try:
+                response = self._send(request_body)
+                status = 'ok'
+            finally:
+                end_time = time.time()
+                if sampled:
+                    self.recorder.record({
+                        'ts': start_time,
+                        'model': self.model_arn,
+                        'prompt': prompt,
+                        'max_tokens': max_tokens,
+                        'temperature': temperature,
+                        'latency': end_time - start_time,
+                        'status': status
+                    })
             # レスポンスの解析
             response_body = json.loads(response['body'].read().decode('utf-8'))
             logger.info(f"Response time is {end_time - start_time:.3f} sec")
@@ -95,6 +150,55 @@ def parse_arguments():
         default='us-west-2',
         help='Region of imported model.'
     )
+
+    parser.add_argument(
+        '--capture-path',
+        type=str,
+        default=None,
+        help='Append requests to this capture file for later replay (default: disabled)'
+    )
+
+    parser.add_argument(
+        '--capture-sample-rate',
+        type=float,
+        default=1.0,
+        help='Fraction of requests to capture (default: 1.0)'
+    )
+
+    parser.add_argument(
+        '--concurrency-config',
+        type=str,
+        default=None,
+        help='Recommended concurrency config written by tune_concurrency.py (optional)'
+    )
+
+    parser.add_argument(
+        '--hedge-percentile',
+        type=float,
+        default=None,
+        help='Send a hedged request when a request exceeds this latency percentile, e.g. 95 (default: disabled)'
+    )
+
+    parser.add_argument(
+        '--hedge-budget',
+        type=float,
+        default=0.1,
+        help='Maximum fraction of requests that may be hedged (default: 0.1)'
+    )
+
+    parser.add_argument(
+        '--hedge-model-arn',
+        type=str,
+        default=None,
+        help='Imported Model ARN to send hedged requests to (default: same as --model-arn)'
+    )
+
+    parser.add_argument(
+        '--tokenizer-path',
+        type=str,
+        default=DEFAULT_MODEL_PATH,
+        help=f'Local model directory with tokenizer.json and config.json (default: {DEFAULT_MODEL_PATH})'
+    )
     
     
     return parser.parse_args()
@@ -102,10 +206,17 @@ def parse_arguments():
 
 def main():
     args = parse_arguments()
+    # 同時実行数・送信レート・リトライ回数（指定がなければ逐次実行）
+    concurrency_config = load_concurrency_config(args.concurrency_config)
     config = {
         'region_name': args.region,  # モデルがインポートされているリージョン
         'model_arn': args.model_arn,
-        'max_retries': 20  # リトライ回数
+        'max_retries': concurrency_config['max_retries'] or 20,  # リトライ回数
+        'capture_path': args.capture_path,
+        'capture_sample_rate': args.capture_sample_rate,
+        'hedge_percentile': args.hedge_percentile,
+        'hedge_budget': args.hedge_budget,
+        'hedge_model_arn': args.hedge_model_arn
     }
 
     # テスト用のプロンプト
@@ -132,16 +243,20 @@ def main():
     ]
 
     invoker = BedrockModelInvoker(config)
+    # プロンプトのトークン数から max_tokens を決める
+    budget = get_prompt_budget(args.tokenizer_path)
 
     logger.info(f"\n==== Started testing imported model. It may take few minutes to start first prompt because of the cold start. ===")
-    # 各プロンプトでテスト
-    for prompt in test_prompts:
+    rate_limiter = RateLimiter(concurrency_config['rate_limit'])
+
+    def test_prompt(prompt):
         try:
+            rate_limiter.acquire()
             logger.info(f"\n=== Testing with prompt: {prompt} ===")
             
             response = invoker.invoke_model(
                 prompt=prompt,
-                max_tokens=256,
+                max_tokens=budget.max_tokens_for(prompt, 'chat'),
                 temperature=0.7
             )
             
@@ -150,7 +265,14 @@ def main():
 
         except Exception as e:
             logger.error(f"Error processing prompt: {str(e)}")
-            continue
+
+    # 各プロンプトでテスト（推奨同時実行数・送信レートに従って並列実行）
+    with ThreadPoolExecutor(max_workers=concurrency_config['max_concurrency']) as executor:
+        for prompt in test_prompts:
+            executor.submit(test_prompt, prompt)
+
+    if invoker.hedge_policy is not None:
+        logger.info(f"Hedge stats: {json.dumps(invoker.hedge_policy.stats())}")
 
 if __name__ == "__main__":
     main()
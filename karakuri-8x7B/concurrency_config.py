@@ -0,0 +1,58 @@
+"""tune_concurrency.py が出力する推奨同時実行数の設定ファイルの読み書きと、送信レートの制限
+"""
+import json
+import threading
+import time
+
+# 設定ファイルがない場合の既定値（max_retries は計測していないため、指定がなければ None）
+DEFAULT_CONCURRENCY_CONFIG = {
+    'max_concurrency': 1,
+    'rate_limit': None,
+    'max_retries': None
+}
+
+
+def load_concurrency_config(path=None):
+    """
+    推奨同時実行数の設定を読み込む
+
+    :param path: 設定ファイルのパス（None の場合は既定値を返す）
+    :return: max_concurrency / rate_limit / max_retries を含む辞書（max_retries は指定がなければ None）
+    """
+    config = dict(DEFAULT_CONCURRENCY_CONFIG)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            loaded = json.load(f)
+        config.update({key: loaded[key] for key in DEFAULT_CONCURRENCY_CONFIG if key in loaded})
+    return config
+
+
+def save_concurrency_config(path, config):
+    """
+    推奨同時実行数の設定を書き出す
+
+    :param path: 設定ファイルのパス
+    :param config: 書き出す設定（計測結果を含めてよい）
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+
+
+class RateLimiter:
+    def __init__(self, rate_limit=None):
+        """
+        :param rate_limit: 1 秒あたりの最大リクエスト数（None の場合は制限しない）
+        """
+        self.interval = 1.0 / rate_limit if rate_limit else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        """前回の送信から interval 秒経つまで待つ（複数スレッドで共有できる）"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_at = max(now, self._next_time)
+            self._next_time = send_at + self.interval
+        time.sleep(max(0.0, send_at - now))
@@ -0,0 +1,171 @@
+"""テールレイテンシを抑えるためのヘッジリクエスト
+
+リクエストが直近のレイテンシの指定パーセンタイルを過ぎても終わらない場合に、
+同じリクエストをもう 1 つ送り（別のエンドポイントにも送れる）、先に終わった方の結果を使います。
+追加の負荷はバジェット（全リクエストに対するヘッジの割合の上限）で制限します。
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from latency_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+# モデル ARN ごとに 1 つの HedgePolicy を共有する（Streamlit の再実行対策）
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+class HedgePolicy:
+    def __init__(self, hedge_percentile=95, budget=0.1, min_samples=20,
+                 window=200, max_workers=32):
+        """
+        :param hedge_percentile: ヘッジを送るまでの待ち時間とするレイテンシのパーセンタイル（0-100、95 なら p95）
+        :param budget: 全リクエストに対するヘッジの割合の上限（0-1）
+        :param min_samples: ヘッジを始めるまでに必要なレイテンシのサンプル数
+        :param window: 待ち時間の計算に使う直近のサンプル数
+        :param max_workers: 同時に実行できる呼び出しの数（ヘッジを含む）
+        """
+        # 0.95 のような割合での指定は p1 未満になり、ほぼ全リクエストがヘッジされるため受け付けない
+        if not 1.0 < hedge_percentile < 100.0:
+            raise ValueError(
+                f"hedge_percentile must be a percentile between 1 and 100 (e.g. 95): {hedge_percentile}"
+            )
+        if not 0.0 <= budget <= 1.0:
+            raise ValueError(f"budget must be between 0 and 1: {budget}")
+
+        self.hedge_percentile = hedge_percentile
+        self.budget = budget
+        self.min_samples = min_samples
+
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        # ヘッジ 1 回につき 1 トークンを消費し、リクエストごとに budget トークンが貯まる
+        self._tokens = 0.0
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+
+    def threshold(self):
+        """ヘッジを送るまでの待ち時間（秒）。サンプルが足りない間は None"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return percentile(list(self._latencies), self.hedge_percentile)
+
+    def _take_token(self):
+        """バジェットに余裕があればトークンを消費して True を返す"""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedged += 1
+                return True
+            return False
+
+    def _timed(self, call, endpoint):
+        """呼び出しを実行し、(結果, レイテンシ) を返す"""
+        start_time = time.monotonic()
+        result = call(endpoint)
+        return result, time.monotonic() - start_time
+
+    def _record_latency(self, future):
+        """1 本目のリクエストのレイテンシを待ち時間の計算用に記録"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, latency = future.result()
+        with self._lock:
+            self._latencies.append(latency)
+
+    def run(self, call, primary_endpoint, hedge_endpoint=None):
+        """
+        必要に応じてヘッジしながら呼び出しを実行
+
+        :param call: エンドポイント（モデル ARN）を受け取って呼び出しを行う関数
+        :param primary_endpoint: 1 本目のリクエストの送り先
+        :param hedge_endpoint: ヘッジの送り先（省略時は primary_endpoint）
+        :return: 先に成功した呼び出しの結果
+        """
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self._tokens + self.budget, 1.0)
+
+        delay = self.threshold()
+        start_time = time.monotonic()
+        primary = self._executor.submit(self._timed, call, primary_endpoint)
+        primary.add_done_callback(self._record_latency)
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_token():
+            return primary.result()[0]
+
+        logger.info(f"Request exceeded {delay:.3f} sec (p{self.hedge_percentile}). Sending a hedged request.")
+        hedge = self._executor.submit(self._timed, call, hedge_endpoint or primary_endpoint)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                if future is hedge:
+                    self._on_hedge_win(primary, time.monotonic() - start_time)
+                # もう一方の結果は使わない（未開始ならキャンセル）
+                for other in pending:
+                    other.cancel()
+                return future.result()[0]
+
+        # 両方失敗した場合は 1 本目の例外を送出
+        return primary.result()[0]
+
+    def _on_hedge_win(self, primary, hedged_latency):
+        """
+        ヘッジが先に終わった場合、1 本目の完了時に短縮できた時間を記録
+
+        :param primary: 1 本目のリクエストの Future
+        :param hedged_latency: 1 本目の送信からヘッジの完了までの時間（秒）
+        """
+        with self._lock:
+            self.hedge_wins += 1
+
+        def record_saved(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            _, primary_latency = future.result()
+            with self._lock:
+                self.latency_saved += max(0.0, primary_latency - hedged_latency)
+
+        primary.add_done_callback(record_saved)
+
+    def stats(self):
+        """ヘッジの統計値を返す"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': self.hedged / self.requests if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'latency_saved_total': self.latency_saved,
+                'latency_saved_mean': self.latency_saved / self.hedge_wins if self.hedge_wins else 0.0
+            }
+
+
+def get_hedge_policy(model_arn, **kwargs):
+    """
+    モデル ARN ごとに共有される HedgePolicy を取得
+
+    :param model_arn: 1 本目のリクエストの送り先のモデル ARN
+    :param kwargs: HedgePolicy の引数（初回作成時のみ使用）
+    :return: HedgePolicy
+    """
+    with _policies_lock:
+        policy = _policies.get(model_arn)
+        if policy is None:
+            policy = HedgePolicy(**kwargs)
+            _policies[model_arn] = policy
+        return policy
@@ -0,0 +1,42 @@
+"""レイテンシの集計用ユーティリティ
+"""
+import math
+
+
+def percentile(values, q):
+    """
+    パーセンタイル値を計算（線形補間）
+
+    :param values: 数値のリスト
+    :param q: パーセンタイル（0-100）
+    :return: パーセンタイル値（values が空の場合は None）
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize_latencies(latencies):
+    """
+    レイテンシのリストから主要な統計値を計算
+
+    :param latencies: レイテンシ（秒）のリスト
+    :return: count / mean / p50 / p90 / p95 / p99 / max を含む辞書
+    """
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+    }
@@ -3,10 +3,21 @@ import logging
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from botocore.exceptions import ClientError
 
+from transfer_checksums import (
+    DEFAULT_PART_SIZE,
+    ChecksumMismatchError,
+    lfs_object_digests,
+    load_manifest,
+    save_manifest,
+    upload_file_with_checksums,
+    verify_manifest_against_s3,
+)
+
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -67,30 +78,93 @@ class ModelDownloader:
             logger.error(f"Error during model download: {str(e)}")
             return False
 
-    def upload_to_s3(self, s3_prefix: str):
-        """モデルを S3 にアップロード"""
+    def _upload_file(self, local_file_path, s3_prefix, lfs_digests, part_size):
+        """1 ファイルをチェックサム付きでアップロードし、マニフェストの 1 エントリを返す"""
+        # S3のキーを作成（ローカルパスの先頭部分を除去）
+        relative_path = os.path.relpath(local_file_path, self.local_path)
+        s3_key = f"{s3_prefix.rstrip('/')}/{relative_path}"
+
+        logger.info(f"Uploading {relative_path} to S3...")
+        result = upload_file_with_checksums(
+            self.s3_client,
+            local_file_path,
+            self.bucket_name,
+            s3_key,
+            part_size=part_size
+        )
+
+        # Git LFS がダウンロード時に検証した SHA-256 と照合
+        expected = lfs_digests.get(relative_path)
+        if expected is not None and expected != result['sha256']:
+            raise ChecksumMismatchError(
+                f"SHA-256 mismatch for {relative_path}: expected {expected}, got {result['sha256']}"
+            )
+
+        result.update({'path': relative_path, 's3_key': s3_key})
+        return result
+
+    def upload_to_s3(self, s3_prefix: str, max_workers=4, part_size=DEFAULT_PART_SIZE,
+                     manifest_path=None):
+        """
+        モデルを S3 にアップロード
+
+        ファイル（シャード）単位で並列にアップロードし、送信するバイト列から
+        SHA-256 と S3 のチェックサムを計算してマニフェストに記録します。
+
+        :param s3_prefix: アップロード先の S3 プレフィックス
+        :param max_workers: 並列にアップロードするファイル数
+        :param part_size: マルチパートアップロードのパートサイズ（バイト）
+        :param manifest_path: チェックサムのマニフェストの出力先
+        """
         try:
-            # モデルディレクトリ内のすべてのファイルをアップロード
-            for root, _, files in os.walk(self.local_path):
+            # モデルディレクトリ内のすべてのファイルをアップロード（.git は除く）
+            local_files = []
+            for root, dirs, files in os.walk(self.local_path):
+                dirs[:] = [d for d in dirs if d != '.git']
                 for file in files:
-                    local_file_path = os.path.join(root, file)
-                    # S3のキーを作成（ローカルパスの先頭部分を除去）
-                    s3_key = os.path.relpath(local_file_path, self.local_path)
-                    
-                    logger.info(f"Uploading {s3_key} to S3...")
-                    self.s3_client.upload_file(
-                        local_file_path,
-                        self.bucket_name,
-                        s3_prefix
-                    )
+                    local_files.append(os.path.join(root, file))
+
+            # Git LFS 管理ファイルの SHA-256 はダウンロード時の値を使う（ファイルは読まない）
+            lfs_digests = lfs_object_digests(self.local_path)
+
+            # 大きいファイルから先に開始して、並列実行の終わりを揃える
+            local_files.sort(key=os.path.getsize, reverse=True)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                entries = list(executor.map(
+                    lambda path: self._upload_file(path, s3_prefix, lfs_digests, part_size),
+                    local_files
+                ))
+
+            if manifest_path:
+                save_manifest(manifest_path, {
+                    'model_id': self.model_id,
+                    'bucket': self.bucket_name,
+                    's3_prefix': s3_prefix,
+                    'files': sorted(entries, key=lambda entry: entry['path'])
+                })
+                logger.info(f"Checksum manifest written to {manifest_path}")
 
             logger.info("All files uploaded to S3 successfully")
             return True
 
-        except ClientError as e:
+        except (ClientError, ChecksumMismatchError) as e:
             logger.error(f"Error uploading to S3: {str(e)}")
             return False
 
+    def verify_s3(self, manifest_path):
+        """マニフェストに記録したチェックサムと S3 上のオブジェクトを照合（データは読まない）"""
+        try:
+            mismatched = verify_manifest_against_s3(self.s3_client, load_manifest(manifest_path))
+        except ClientError as e:
+            logger.error(f"Error verifying S3 objects: {str(e)}")
+            return False
+
+        if mismatched:
+            logger.error(f"Checksum mismatch on S3: {mismatched}")
+            return False
+        logger.info("All S3 objects match the checksum manifest")
+        return True
+
     def cleanup(self):
         """ダウンロードしたファイルを削除"""
         try:
@@ -140,6 +214,33 @@ def parse_arguments():
         action='store_true',
         help='Clean up local files after upload'
     )
+
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=4,
+        help='Number of files uploaded in parallel (default: 4)'
+    )
+
+    parser.add_argument(
+        '--part-size-mb',
+        type=int,
+        default=DEFAULT_PART_SIZE // (1024 * 1024),
+        help='Multipart upload part size in MiB (default: 64)'
+    )
+
+    parser.add_argument(
+        '--manifest-path',
+        type=str,
+        default=None,
+        help='Path of the checksum manifest (default: <local-path>.checksums.json)'
+    )
+
+    parser.add_argument(
+        '--verify-only',
+        action='store_true',
+        help='Only verify S3 objects against an existing checksum manifest'
+    )
     
     return parser.parse_args()
 
@@ -153,6 +254,12 @@ def main():
         bucket_name=args.bucket,
         local_path=args.local_path
     )
+    manifest_path = args.manifest_path or f"{args.local_path.rstrip('/')}.checksums.json"
+
+    if args.verify_only:
+        if not downloader.verify_s3(manifest_path):
+            raise Exception("S3 verification failed")
+        return
     
     try:
         # モデルをダウンロード
@@ -160,7 +267,12 @@ def main():
             raise Exception("Model download failed")
         
         # S3 にアップロード
-        if not downloader.upload_to_s3(s3_prefix=args.s3_prefix):
+        if not downloader.upload_to_s3(
+            s3_prefix=args.s3_prefix,
+            max_workers=args.max_workers,
+            part_size=args.part_size_mb * 1024 * 1024,
+            manifest_path=manifest_path
+        ):
             raise Exception("S3 upload failed")
         
         logger.info("Process completed successfully")
@@ -0,0 +1,199 @@
+"""モデルの転送と同じパスでチェックサムを計算する
+
+- Git LFS 管理のファイルは、ダウンロード時に Git LFS が検証した oid（SHA-256）をそのまま使う
+- S3 へのアップロードでは、ファイルを mmap で読み、送信するパートのバイト列から
+  SHA-256（ファイル全体とパートごと）を計算して、S3 の追加チェックサムとして送る
+
+ファイルを読むのはアップロード時の 1 回だけで、検証のための追加の読み込みは発生しません。
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# S3 のマルチパートアップロードの上限
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+
+
+class ChecksumMismatchError(Exception):
+    """計算したチェックサムが期待値と一致しない"""
+
+
+def lfs_object_digests(repo_path):
+    """
+    Git LFS 管理ファイルの SHA-256 を取得（ファイルの中身は読まない）
+
+    Git LFS の oid はファイル内容の SHA-256 で、ダウンロード時に Git LFS が検証済みです。
+
+    :param repo_path: クローンしたリポジトリのパス
+    :return: {リポジトリからの相対パス: SHA-256 の16進文字列}
+    """
+    try:
+        result = subprocess.run(
+            ['git', 'lfs', 'ls-files', '--long'],
+            cwd=repo_path, check=True, capture_output=True, text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.warning(f"Could not list Git LFS objects: {str(e)}")
+        return {}
+
+    digests = {}
+    for line in result.stdout.splitlines():
+        # 形式: "<oid> <*|-> <path>"
+        parts = line.split(' ', 2)
+        if len(parts) == 3:
+            digests[parts[2]] = parts[0]
+    return digests
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode('ascii')
+
+
+def _part_size_for(file_size, part_size):
+    """パート数が上限を超えないようにパートサイズを調整"""
+    return max(part_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+
+
+def upload_file_with_checksums(s3_client, local_file_path, bucket_name, s3_key,
+                               part_size=DEFAULT_PART_SIZE):
+    """
+    ファイルを 1 回だけ読みながら、SHA-256 を計算して S3 にアップロード
+
+    パートごとの SHA-256 を ChecksumSHA256 として送るため、S3 側でも受信データが検証されます。
+
+    :param s3_client: boto3 の S3 クライアント
+    :param local_file_path: アップロードするファイルのパス
+    :param bucket_name: アップロード先の S3 バケット名
+    :param s3_key: アップロード先の S3 キー
+    :param part_size: マルチパートアップロードのパートサイズ（バイト）
+    :return: size / sha256 / s3_checksum_sha256 / part_size を含む辞書
+    """
+    file_size = os.path.getsize(local_file_path)
+    part_size = _part_size_for(file_size, part_size)
+    whole = hashlib.sha256()
+
+    with open(local_file_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size else None
+        try:
+            if file_size <= part_size:
+                data = mm[:] if mm is not None else b''
+                whole.update(data)
+                s3_checksum = _b64(hashlib.sha256(data).digest())
+                response = s3_client.put_object(
+                    Bucket=bucket_name,
+                    Key=s3_key,
+                    Body=data,
+                    ChecksumAlgorithm='SHA256',
+                    ChecksumSHA256=s3_checksum
+                )
+            else:
+                s3_checksum, response = _multipart_upload(
+                    s3_client, mm, file_size, part_size, bucket_name, s3_key, whole
+                )
+        finally:
+            if mm is not None:
+                mm.close()
+
+    # S3 が計算したチェックサムと照合（データの再読み込みは不要）
+    returned = response.get('ChecksumSHA256')
+    if returned is not None and returned != s3_checksum:
+        raise ChecksumMismatchError(
+            f"S3 checksum mismatch for {s3_key}: expected {s3_checksum}, got {returned}"
+        )
+
+    return {
+        'size': file_size,
+        'sha256': whole.hexdigest(),
+        's3_checksum_sha256': s3_checksum,
+        'part_size': part_size
+    }
+
+
+def _multipart_upload(s3_client, mm, file_size, part_size, bucket_name, s3_key, whole):
+    """パートごとに SHA-256 を計算しながらマルチパートアップロード"""
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket_name,
+        Key=s3_key,
+        ChecksumAlgorithm='SHA256'
+    )['UploadId']
+
+    parts = []
+    part_digests = []
+    try:
+        for part_number, offset in enumerate(range(0, file_size, part_size), start=1):
+            data = mm[offset:offset + part_size]
+            whole.update(data)
+            digest = hashlib.sha256(data).digest()
+            part_digests.append(digest)
+            response = s3_client.upload_part(
+                Bucket=bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data,
+                ChecksumAlgorithm='SHA256',
+                ChecksumSHA256=_b64(digest)
+            )
+            parts.append({
+                'ETag': response['ETag'],
+                'PartNumber': part_number,
+                'ChecksumSHA256': _b64(digest)
+            })
+
+        response = s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        raise
+
+    # マルチパートの場合、S3 のチェックサムは「パートのチェックサムを連結したもののチェックサム」
+    composite = _b64(hashlib.sha256(b''.join(part_digests)).digest())
+    return f"{composite}-{len(part_digests)}", response
+
+
+def save_manifest(path, manifest):
+    """チェックサムのマニフェストを書き出す"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def load_manifest(path):
+    """チェックサムのマニフェストを読み込む"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verify_manifest_against_s3(s3_client, manifest):
+    """
+    マニフェストに記録したチェックサムと S3 上のオブジェクトのチェックサムを照合
+
+    HeadObject で S3 が保持するチェックサムを取得するだけで、データは読み込みません。
+
+    :param s3_client: boto3 の S3 クライアント
+    :param manifest: save_manifest で書き出したマニフェスト
+    :return: 一致しなかった S3 キーのリスト
+    """
+    mismatched = []
+    for entry in manifest['files']:
+        response = s3_client.head_object(
+            Bucket=manifest['bucket'],
+            Key=entry['s3_key'],
+            ChecksumMode='ENABLED'
+        )
+        if response.get('ChecksumSHA256') != entry['s3_checksum_sha256'] \
+                or response.get('ContentLength') != entry['size']:
+            mismatched.append(entry['s3_key'])
+    return mismatched
@@ -0,0 +1,116 @@
+"""ダウンロードしたトークナイザーを使ったプロンプトのトークン数管理
+
+model_setup/download_upload_model.py がダウンロードしたモデルのディレクトリから
+トークナイザーとコンテキスト長を読み込み、プロンプトのトークン数に応じて max_tokens を決めます。
+トークナイザーが使えない場合（tokenizers 未インストール、ローカルのファイル削除済みなど）は、
+UTF-8 のバイト数をトークン数の上限として使います。
+"""
+import functools
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = "models/karakuri-ai/karakuri-lm-8x7b-chat-v0.1"
+DEFAULT_CONTEXT_WINDOW = 32768
+
+# タスクごとの生成トークン数の上限
+DEFAULT_OUTPUT_BUDGETS = {
+    'chat': 256,
+    'lottery': 96
+}
+
+
+class PromptTooLongError(ValueError):
+    """プロンプトがコンテキスト長に収まらない"""
+
+
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(model_path):
+    """
+    モデルのディレクトリからトークナイザーを読み込む（パスごとに 1 回だけ読み込む）
+
+    :param model_path: モデルをダウンロードしたローカルパス
+    :return: tokenizers.Tokenizer（読み込めない場合は None）
+    """
+    tokenizer_file = os.path.join(model_path, 'tokenizer.json')
+    if not os.path.exists(tokenizer_file):
+        logger.warning(f"{tokenizer_file} not found. Falling back to UTF-8 byte counts as an upper bound.")
+        return None
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        logger.warning("tokenizers is not installed. Falling back to UTF-8 byte counts as an upper bound.")
+        return None
+    return Tokenizer.from_file(tokenizer_file)
+
+
+def load_context_window(model_path):
+    """
+    モデルの config.json からコンテキスト長を読み込む
+
+    :param model_path: モデルをダウンロードしたローカルパス
+    :return: コンテキスト長（読み込めない場合は DEFAULT_CONTEXT_WINDOW）
+    """
+    try:
+        with open(os.path.join(model_path, 'config.json'), encoding='utf-8') as f:
+            return json.load(f).get('max_position_embeddings', DEFAULT_CONTEXT_WINDOW)
+    except (OSError, json.JSONDecodeError):
+        return DEFAULT_CONTEXT_WINDOW
+
+
+class PromptBudget:
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, output_budgets=None,
+                 safety_margin=16, cache_size=8192):
+        """
+        :param model_path: モデルをダウンロードしたローカルパス
+        :param output_budgets: タスクごとの生成トークン数の上限
+        :param safety_margin: コンテキスト長に対して残しておくトークン数
+        :param cache_size: トークン数をキャッシュする文字列の数
+        """
+        self.tokenizer = load_tokenizer(model_path)
+        self.context_window = load_context_window(model_path)
+        self.output_budgets = dict(DEFAULT_OUTPUT_BUDGETS, **(output_budgets or {}))
+        self.safety_margin = safety_margin
+        # 同じテンプレートや名前を何度も数えないようにキャッシュする
+        self.count_tokens = functools.lru_cache(maxsize=cache_size)(self._count_tokens)
+
+    def _count_tokens(self, text):
+        """テキストのトークン数を数える"""
+        if self.tokenizer is None:
+            # byte fallback により語彙にない文字は 1 バイト 1 トークンになるため、
+            # バイト数（と先頭に付く区切りの 1 トークン）が上限になる
+            return len(text.encode('utf-8')) + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def max_prompt_tokens(self, task):
+        """指定したタスクで使えるプロンプトのトークン数の上限"""
+        return self.context_window - self.output_budgets[task] - self.safety_margin
+
+    def max_tokens_for(self, prompt, task):
+        """
+        プロンプトの長さとタスクの生成トークン数の上限から max_tokens を決める
+
+        :param prompt: 入力プロンプト
+        :param task: タスク名（output_budgets のキー）
+        :return: max_tokens
+        """
+        prompt_tokens = self.count_tokens(prompt)
+        available = self.context_window - prompt_tokens - self.safety_margin
+        if available <= 0:
+            raise PromptTooLongError(
+                f"Prompt has {prompt_tokens} tokens, exceeding the context window of {self.context_window}"
+            )
+        return min(self.output_budgets[task], available)
+
+
+@functools.lru_cache(maxsize=None)
+def get_prompt_budget(model_path=DEFAULT_MODEL_PATH):
+    """
+    パスごとに共有される PromptBudget を取得
+
+    :param model_path: モデルをダウンロードしたローカルパス
+    :return: PromptBudget
+    """
+    return PromptBudget(model_path)
@@ -0,0 +1,200 @@
+"""キャプチャしたリクエストを元の到着間隔で再送し、モデル間のレイテンシを比較する
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from call_imported_model import BedrockModelInvoker
+from latency_stats import summarize_latencies
+from traffic_capture import load_capture
+
+# ロギングの設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class TrafficReplayer:
+    def __init__(self, invoker, speed=1.0, max_workers=64):
+        """
+        :param invoker: リクエストを送る BedrockModelInvoker
+        :param speed: 再生速度（2.0 なら到着間隔を 1/2 にして再送）
+        :param max_workers: 同時に送信できる最大リクエスト数
+        """
+        if speed <= 0:
+            raise ValueError(f"speed must be positive: {speed}")
+
+        self.invoker = invoker
+        self.speed = speed
+        self.max_workers = max_workers
+
+    def _send(self, entry, scheduled_at):
+        """1 リクエストを送信し、レイテンシを計測"""
+        start_time = time.monotonic()
+        try:
+            self.invoker.invoke_model(
+                prompt=entry['prompt'],
+                max_tokens=entry['max_tokens'],
+                temperature=entry['temperature']
+            )
+            status = 'ok'
+        except Exception as e:
+            logger.error(f"Replayed request failed: {str(e)}")
+            status = 'error'
+        end_time = time.monotonic()
+        return {
+            'latency': end_time - start_time,
+            # スケジュールより送信が遅れた時間（ワーカー不足の検出用）
+            'lag': start_time - scheduled_at,
+            'status': status
+        }
+
+    def replay(self, entries):
+        """
+        キャプチャを元の到着間隔（を speed で割った間隔）で再送
+
+        :param entries: load_capture で読み込んだ記録のリスト
+        :return: リクエストごとの結果のリスト
+        """
+        if not entries:
+            return []
+
+        first_ts = entries[0]['ts']
+        base = time.monotonic()
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for entry in entries:
+                scheduled_at = base + (entry['ts'] - first_ts) / self.speed
+                delay = scheduled_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self._send, entry, scheduled_at))
+            return [future.result() for future in futures]
+
+
+def summarize_results(results):
+    """再送結果を集計"""
+    latencies = [r['latency'] for r in results if r['status'] == 'ok']
+    summary = summarize_latencies(latencies)
+    summary['errors'] = sum(1 for r in results if r['status'] != 'ok')
+    summary['max_lag'] = max((r['lag'] for r in results), default=0.0)
+    return summary
+
+
+def format_comparison(summaries):
+    """ARN ごとの集計結果を表形式の文字列に整形"""
+    keys = ['count', 'errors', 'mean', 'p50', 'p90', 'p95', 'p99', 'max', 'max_lag']
+    labels = list(summaries.keys())
+    lines = ['metric    ' + ''.join(f"{label[-24:]:>26}" for label in labels)]
+    for key in keys:
+        row = f"{key:<10}"
+        for label in labels:
+            value = summaries[label].get(key)
+            if value is None:
+                row += f"{'-':>26}"
+            elif isinstance(value, float):
+                row += f"{value:>26.3f}"
+            else:
+                row += f"{value:>26}"
+        lines.append(row)
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description='Replay captured requests against imported models and compare latency'
+    )
+
+    parser.add_argument(
+        '--capture-path',
+        type=str,
+        required=True,
+        help='Capture file written by --capture-path of the invokers'
+    )
+
+    parser.add_argument(
+        '--model-arn',
+        type=str,
+        required=True,
+        help='Imported Model ARN to replay against'
+    )
+
+    parser.add_argument(
+        '--compare-arn',
+        type=str,
+        default=None,
+        help='Second Imported Model ARN to compare latency with (optional)'
+    )
+
+    parser.add_argument(
+        '--region',
+        type=str,
+        default='us-west-2',
+        help='Region of imported model.'
+    )
+
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=1.0,
+        help='Replay speed multiplier (default: 1.0 = original inter-arrival times)'
+    )
+
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=64,
+        help='Maximum number of in-flight requests (default: 64)'
+    )
+
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Write the latency summary to this JSON file (optional)'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    entries = load_capture(args.capture_path)
+    if not entries:
+        logger.error(f"No requests found in {args.capture_path}")
+        return
+    duration = entries[-1]['ts'] - entries[0]['ts']
+    logger.info(f"Loaded {len(entries)} requests spanning {duration:.1f} sec")
+
+    model_arns = [args.model_arn]
+    if args.compare_arn:
+        model_arns.append(args.compare_arn)
+
+    # 互いの負荷が干渉しないよう、ARN ごとに順番に再送する
+    summaries = {}
+    for model_arn in model_arns:
+        invoker = BedrockModelInvoker({
+            'region_name': args.region,
+            'model_arn': model_arn,
+            'max_retries': 20
+        })
+        replayer = TrafficReplayer(invoker, speed=args.speed, max_workers=args.max_workers)
+        logger.info(f"Replaying against {model_arn} at {args.speed}x speed...")
+        summaries[model_arn] = summarize_results(replayer.replay(entries))
+
+    logger.info("Latency comparison (sec):\n" + format_comparison(summaries))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        logger.info(f"Summary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
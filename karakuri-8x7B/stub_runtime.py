@@ -0,0 +1,65 @@
+"""Bedrock Runtime を模したローカルのスタブ
+
+同時に処理できるリクエスト数に上限があり、上限を超えたリクエストは待ち行列に並ぶ
+推論サーバーを模擬します。実際のモデルを使わずにツールの動作確認を行うために使います。
+"""
+import io
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class StubBedrockRuntime:
+    def __init__(self, capacity=8, base_latency=0.2, per_token_latency=0.002,
+                 jitter=0.1, max_queue=64, seed=None):
+        """
+        :param capacity: 同時に処理できるリクエスト数
+        :param base_latency: 1 リクエストあたりの固定の処理時間（秒）
+        :param per_token_latency: 生成 1 トークンあたりの処理時間（秒）
+        :param jitter: 処理時間のばらつき（base に対する割合）
+        :param max_queue: 待ち行列の上限（超えると ThrottlingException を返す）
+        :param seed: 乱数シード
+        """
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.jitter = jitter
+        self.max_queue = max_queue
+
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._random = random.Random(seed)
+
+    def _service_time(self, max_tokens):
+        """1 リクエストの処理時間を計算"""
+        with self._lock:
+            noise = self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.base_latency * (1 + noise) + self.per_token_latency * max_tokens)
+
+    def invoke_model(self, modelId, body, contentType="application/json", accept="application/json"):
+        """bedrock-runtime の invoke_model と同じ形式で応答を返す"""
+        request_body = json.loads(body)
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise ClientError(
+                    {'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests (stub)'}},
+                    'InvokeModel'
+                )
+            self._waiting += 1
+
+        with self._slots:
+            with self._lock:
+                self._waiting -= 1
+            time.sleep(self._service_time(request_body.get('max_tokens', 0)))
+
+        response_body = {
+            "outputs": [{
+                "text": json.dumps({"name": "スタブ太郎"}, ensure_ascii=False),
+                "stop_reason": "stop"
+            }]
+        }
+        return {'body': io.BytesIO(json.dumps(response_body).encode('utf-8'))}
@@ -0,0 +1,305 @@
+"""参加者が多い場合にトーナメント形式で抽選を行う
+
+参加者をコンテキストに収まる大きさのグループに分けて各グループの当選者を並列に抽選し、
+グループの当選者の中から最終的な当選者を抽選します。最終ラウンドでは各当選者に
+グループの人数を重みとして付けることで、全参加者から一様に選ばれるようにします。
+"""
+import itertools
+import json
+import logging
+import math
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, ConnectTimeoutError, ReadTimeoutError
+
+from concurrency_config import RateLimiter
+from prompt_budget import PromptTooLongError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+
+# 一時的なエラーとみなし、リトライ後に乱数での抽選へ切り替えるエラーコード
+# （それ以外の ARN の誤りや権限不足などはそのまま送出する）
+TRANSIENT_ERROR_CODES = {
+    'ThrottlingException',
+    'ModelTimeoutException',
+    'ModelNotReadyException',
+    'ServiceUnavailableException',
+    'InternalServerException'
+}
+
+_FORMAT = """[FORMAT]
+{
+  "name": {
+    "type": "string",
+    "description": "抽選された人の名前（フルネーム）"
+  }
+}
+[/FORMAT]"""
+
+
+def create_prompt(names):
+    """
+    名前のリストからプロンプトを生成
+    """
+    names_list = "\n".join([f"- {name.strip()}" for name in names if name.strip()])
+
+    prompt = f"""あなたは、抽選を行うロボットです。下記リストの中から、ランダムな形で人を選び、それを出力してください。
+出力形式は下記のフォーマットのjsonでお願いします。jsonのみ出力してください。
+[LIST]
+{names_list}
+[/LIST]
+{_FORMAT}"""
+
+    return f"[INST]{prompt}[/INST]"
+
+
+def create_weighted_prompt(candidates):
+    """
+    重み（口数）付きの候補者リストからプロンプトを生成
+
+    :param candidates: (名前, 重み) のリスト
+    """
+    names_list = "\n".join([f"- {name}（口数: {weight}）" for name, weight in candidates])
+
+    prompt = f"""あなたは、抽選を行うロボットです。下記リストの中から、口数に比例した確率で人を1人選び、それを出力してください。
+出力形式は下記のフォーマットのjsonでお願いします。jsonのみ出力してください。名前に口数は含めないでください。
+[LIST]
+{names_list}
+[/LIST]
+{_FORMAT}"""
+
+    return f"[INST]{prompt}[/INST]"
+
+
+class InvalidDrawError(Exception):
+    """モデルの出力から候補者を特定できない"""
+
+
+class DrawFailedError(Exception):
+    """モデルによる抽選が行えず、乱数での抽選に頼りすぎている"""
+
+
+class TournamentDraw:
+    def __init__(self, invoker, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=8,
+                 max_attempts=2, max_tokens=256, temperature=0.7, budget=None,
+                 rate_limit=None):
+        """
+        :param invoker: 抽選に使う BedrockModelInvoker
+        :param chunk_size: 1 回の抽選に含める最大人数
+        :param max_workers: 並列に実行する抽選の数
+        :param max_attempts: 1 グループあたりの抽選の試行回数
+        :param max_tokens: 生成する最大トークン数（budget を指定した場合は使わない）
+        :param temperature: 生成の多様性（0-1）
+        :param budget: PromptBudget（指定するとグループの大きさと max_tokens をトークン数から決める）
+        :param rate_limit: 1 秒あたりの最大リクエスト数（None の場合は制限しない）
+        """
+        if chunk_size < 2:
+            raise ValueError(f"chunk_size must be at least 2: {chunk_size}")
+
+        self.invoker = invoker
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.budget = budget
+        # 全グループの抽選で共有し、並列実行してもモデルへの送信レートを超えないようにする
+        self._rate_limiter = RateLimiter(rate_limit)
+        self._random = random.SystemRandom()
+
+    def _line_tokens(self, candidates):
+        """
+        候補者ごとのリスト 1 行分のトークン数と、テンプレートのトークン数を数える
+
+        重みが混在する場合は、重み付きの行（多めの見積もり）で数える
+        """
+        if len({weight for _, weight in candidates}) == 1:
+            lines = [f"- {name}\n" for name, _ in candidates]
+            template = create_prompt([])
+        else:
+            lines = [f"- {name}（口数: {weight}）\n" for name, weight in candidates]
+            template = create_weighted_prompt([])
+        return [self.budget.count_tokens(line) for line in lines], self.budget.count_tokens(template)
+
+    def _split_into(self, candidates, num_chunks):
+        """候補者を num_chunks 個のグループに分割（各グループの人数差は 1 以内）"""
+        base, extra = divmod(len(candidates), num_chunks)
+        chunks = []
+        offset = 0
+        for i in range(num_chunks):
+            size = base + (1 if i < extra else 0)
+            chunks.append(candidates[offset:offset + size])
+            offset += size
+        return chunks
+
+    def split(self, candidates):
+        """
+        候補者を chunk_size 以下（budget 指定時はコンテキスト長にも収まる）グループに分割
+
+        ラウンドごとに候補者が必ず減るよう、グループ数は len(candidates) - 1 を超えない
+
+        :param candidates: (名前, 重み) のリスト
+        :return: グループのリスト
+        """
+        num_chunks = math.ceil(len(candidates) / self.chunk_size)
+        if self.budget is None:
+            return self._split_into(candidates, num_chunks)
+
+        # 名前ごとのトークン数はラウンドごとに 1 回だけ数え、累積和でグループの合計を求める
+        line_tokens, template_tokens = self._line_tokens(candidates)
+        cumulative = list(itertools.accumulate(line_tokens, initial=0))
+        limit = self.budget.max_prompt_tokens('lottery') - template_tokens
+
+        max_chunks = len(candidates) - 1
+        num_chunks = min(max_chunks, max(num_chunks, math.ceil(cumulative[-1] / limit)))
+        while True:
+            chunks = self._split_into(candidates, num_chunks)
+            offsets = list(itertools.accumulate((len(chunk) for chunk in chunks), initial=0))
+            fits = all(
+                cumulative[end] - cumulative[start] <= limit
+                for start, end in zip(offsets, offsets[1:])
+            )
+            if fits or num_chunks >= max_chunks:
+                # 収まらないグループは draw_chunk で PromptTooLongError として扱う
+                return chunks
+            num_chunks += 1
+
+    def _check_name_lengths(self, candidates):
+        """
+        どの 2 人でも 1 つのプロンプトに収まるよう、長すぎる名前を抽選前に拒否する
+
+        :param candidates: (名前, 重み) のリスト
+        """
+        template_tokens = self.budget.count_tokens(create_weighted_prompt([]))
+        # 最終ラウンドの口数は参加者数以下なので、その桁数で見積もる
+        max_line = (self.budget.max_prompt_tokens('lottery') - template_tokens) // 2
+        weight_label = len(candidates)
+        too_long = [
+            name for name, _ in candidates
+            if self.budget.count_tokens(f"- {name}（口数: {weight_label}）\n") > max_line
+        ]
+        if too_long:
+            raise ValueError(
+                f"{len(too_long)} name(s) are too long to fit in a draw prompt "
+                f"(max {max_line} tokens per line): {too_long[0][:50]}..."
+            )
+
+    def _match(self, text, candidates):
+        """モデルの出力から当選した候補者を特定"""
+        try:
+            result_json = json.loads(text)
+        except json.JSONDecodeError:
+            json_match = re.search(r'\{.*?\}', text, re.DOTALL)
+            if not json_match:
+                raise InvalidDrawError(f"JSON not found in response: {text}")
+            result_json = json.loads(json_match.group())
+        if not isinstance(result_json, dict) or not isinstance(result_json.get('name'), str):
+            raise InvalidDrawError(f"Unexpected response format: {text}")
+
+        name = result_json['name'].strip()
+        for candidate in candidates:
+            if candidate[0] == name:
+                return candidate
+        # 読み仮名の省略などに対応するため、部分一致で 1 人に絞れる場合は採用
+        partial = [c for c in candidates if name and (name in c[0] or c[0] in name)]
+        if len(partial) == 1:
+            return partial[0]
+        raise InvalidDrawError(f"Drawn name is not in the list: {name}")
+
+    def draw_chunk(self, chunk):
+        """
+        1 グループの抽選を実行
+
+        :param chunk: (名前, 重み) のリスト
+        :return: ((当選者の名前, グループの重みの合計), 乱数での抽選に切り替えたか)
+        """
+        total_weight = sum(weight for _, weight in chunk)
+        if len(chunk) == 1:
+            return (chunk[0][0], total_weight), False
+
+        if len({weight for _, weight in chunk}) == 1:
+            prompt = create_prompt([name for name, _ in chunk])
+        else:
+            prompt = create_weighted_prompt(chunk)
+
+        max_tokens = self.max_tokens
+        attempts = self.max_attempts
+        if self.budget is not None:
+            try:
+                max_tokens = self.budget.max_tokens_for(prompt, 'lottery')
+            except PromptTooLongError as e:
+                # 名前が長すぎてグループをこれ以上分割できない場合は、モデルを呼び出さない
+                logger.error(f"Group prompt does not fit the context window: {str(e)}")
+                attempts = 0
+
+        for attempt in range(1, attempts + 1):
+            self._rate_limiter.acquire()
+            try:
+                result = self.invoker.invoke_model(
+                    prompt=prompt,
+                    max_tokens=max_tokens,
+                    temperature=self.temperature
+                )
+                name, _ = self._match(result.get("outputs")[0].get("text"), chunk)
+                return (name, total_weight), False
+            except (InvalidDrawError, json.JSONDecodeError, TypeError, IndexError) as e:
+                logger.warning(f"Invalid draw result (attempt {attempt}/{self.max_attempts}): {str(e)}")
+            except ClientError as e:
+                # スロットリングなど、botocore のリトライでも解消しなかった一時的なエラーのみ扱う
+                if e.response['Error']['Code'] not in TRANSIENT_ERROR_CODES:
+                    raise
+                logger.error(f"Error invoking model (attempt {attempt}/{self.max_attempts}): {str(e)}")
+            except (ConnectTimeoutError, ReadTimeoutError) as e:
+                logger.error(f"Timeout invoking model (attempt {attempt}/{self.max_attempts}): {str(e)}")
+
+        # モデルの呼び出しや出力が使えない場合は、このグループだけ重みに従って乱数で選ぶ
+        logger.warning("Falling back to a weighted random choice for this group")
+        name, _ = self._random.choices(chunk, weights=[weight for _, weight in chunk])[0]
+        return (name, total_weight), True
+
+    def draw(self, names):
+        """
+        参加者全員から 1 人を抽選
+
+        :param names: 参加者の名前のリスト
+        :return: name（当選者）、rounds（ラウンドごとのグループ数）、
+                 fallbacks（乱数での抽選に切り替えたグループ数）を含む辞書
+        """
+        candidates = [(name.strip(), 1) for name in names if name.strip()]
+        if not candidates:
+            raise ValueError("No participants to draw from")
+
+        if self.budget is not None:
+            self._check_name_lengths(candidates)
+
+        # モデルが並び順に偏って選ぶ影響を抑えるため、順番を混ぜておく
+        self._random.shuffle(candidates)
+
+        rounds = []
+        fallbacks = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(candidates) > 1:
+                chunks = self.split(candidates)
+                rounds.append(len(chunks))
+                logger.info(f"Round {len(rounds)}: drawing {len(chunks)} group(s) from {len(candidates)} candidates")
+                results = list(executor.map(self.draw_chunk, chunks))
+                if len(results) >= len(candidates):
+                    raise DrawFailedError(
+                        f"Round {len(rounds)} did not reduce the number of candidates ({len(candidates)})"
+                    )
+                candidates = [winner for winner, _ in results]
+
+                # モデルを呼び出したグループがすべて乱数での抽選になった場合（最終ラウンドを含む）は失敗とする
+                round_fallbacks = sum(1 for _, fell_back in results if fell_back)
+                drawn = sum(1 for chunk in chunks if len(chunk) > 1)
+                fallbacks += round_fallbacks
+                if drawn and round_fallbacks == drawn:
+                    raise DrawFailedError(
+                        f"All {drawn} group(s) in round {len(rounds)} fell back to a random choice"
+                    )
+
+        return {'name': candidates[0][0], 'rounds': rounds, 'fallbacks': fallbacks}
@@ -0,0 +1,137 @@
+"""BedrockModelInvoker に送ったリクエストをキャプチャしてファイルに追記する
+
+キャプチャは JSON Lines 形式の追記専用ログで、1 行が 1 リクエストに対応します。
+書き込みはバックグラウンドスレッドで行うため、推論呼び出しの経路では
+キューへの追加のみが発生します。
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 書き込みスレッドを停止させるための番兵
+_STOP = object()
+
+# パスごとに 1 つの TrafficRecorder を共有する（Streamlit の再実行対策）
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def _validate_sample_rate(sample_rate):
+    """サンプリング率が 0-1 の範囲にあるか確認"""
+    if not 0.0 <= sample_rate <= 1.0:
+        raise ValueError(f"sample_rate must be between 0 and 1: {sample_rate}")
+
+
+class TrafficRecorder:
+    def __init__(self, path, sample_rate=1.0, max_queue_size=10000):
+        """
+        :param path: キャプチャを追記するファイルパス
+        :param sample_rate: キャプチャするリクエストの割合（0-1）
+        :param max_queue_size: 書き込み待ちの最大件数（超えた分は破棄）
+        """
+        _validate_sample_rate(sample_rate)
+
+        self.path = path
+        self.sample_rate = sample_rate
+        self.dropped = 0
+
+        # 書き込めないパスは書き込みスレッドではなく、ここで起動時にエラーにする
+        self._file = open(path, 'a', encoding='utf-8')
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(
+            target=self._writer_loop,
+            name='traffic-recorder',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def should_sample(self):
+        """このリクエストをキャプチャするか判定"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, entry):
+        """
+        キャプチャを書き込みキューに追加（ブロックしない）
+
+        :param entry: 1 リクエスト分の記録（辞書）
+        """
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer_loop(self):
+        """キューから取り出した記録をファイルへ追記"""
+        with self._file as f:
+            while True:
+                entry = self._queue.get()
+                if entry is _STOP:
+                    break
+                try:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+                except (TypeError, ValueError) as e:
+                    logger.error(f"Failed to serialize capture entry: {str(e)}")
+                except OSError as e:
+                    logger.error(f"Failed to write capture entry: {str(e)}")
+                # キューが空になったタイミングでまとめて flush する
+                if self._queue.empty():
+                    try:
+                        f.flush()
+                    except OSError as e:
+                        logger.error(f"Failed to flush capture file: {str(e)}")
+
+    def close(self):
+        """未書き込みの記録をすべて書き出してから停止"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.dropped:
+            logger.warning(f"{self.dropped} capture entries were dropped because the queue was full")
+
+
+def get_recorder(path, sample_rate=1.0):
+    """
+    パスごとに共有される TrafficRecorder を取得
+
+    :param path: キャプチャを追記するファイルパス
+    :param sample_rate: キャプチャするリクエストの割合（0-1）
+    :return: TrafficRecorder
+    """
+    _validate_sample_rate(sample_rate)
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None:
+            recorder = TrafficRecorder(path, sample_rate=sample_rate)
+            _recorders[path] = recorder
+        else:
+            recorder.sample_rate = sample_rate
+        return recorder
+
+
+def load_capture(path):
+    """
+    キャプチャファイルを読み込み、送信時刻順に並べて返す
+
+    :param path: キャプチャファイルのパス
+    :return: 記録（辞書）のリスト
+    """
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 書き込み途中で停止した場合など、壊れた行は読み飛ばす
+                logger.warning(f"Skipping malformed capture line {line_no}")
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
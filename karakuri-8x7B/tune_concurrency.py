@@ -0,0 +1,311 @@
+"""同時実行数を段階的に上げて、import したモデルの飽和点（knee）を探す
+
+各段階で一定時間リクエストを送り続け、goodput（SLO を満たした成功リクエスト/秒）と
+テールレイテンシを計測します。goodput が伸びなくなる、またはテールレイテンシや
+エラー率が悪化した段階の手前を飽和点とし、推奨設定をファイルに書き出します。
+"""
+import argparse
+import logging
+import threading
+import time
+
+from call_imported_model import BedrockModelInvoker
+from concurrency_config import save_concurrency_config
+from latency_stats import percentile
+
+# ロギングの設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = "[INST]富士山の標高は何メートルですか？[/INST]"
+
+
+class ConcurrencyTuner:
+    def __init__(self, invoker, prompt=DEFAULT_PROMPT, max_tokens=256,
+                 step_duration=60.0, latency_slo=None, latency_factor=2.0,
+                 min_gain=0.05, max_error_rate=0.01):
+        """
+        :param invoker: 計測に使う BedrockModelInvoker
+        :param prompt: 計測に使うプロンプト
+        :param max_tokens: 生成する最大トークン数
+        :param step_duration: 1 段階あたりの計測時間（秒）
+        :param latency_slo: p99 レイテンシの上限（秒）。超えたリクエストは goodput に数えない
+        :param latency_factor: 同時実行数 1 の p99 の何倍を超えたら飽和とみなすか
+        :param min_gain: 前段階からの goodput の伸びがこの割合未満なら飽和とみなす
+        :param max_error_rate: エラー率がこれを超えたら飽和とみなす
+        """
+        self.invoker = invoker
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.step_duration = step_duration
+        self.latency_slo = latency_slo
+        self.latency_factor = latency_factor
+        self.min_gain = min_gain
+        self.max_error_rate = max_error_rate
+
+    def warm_up(self):
+        """コールドスタートの影響を除くため、計測前に 1 回呼び出す"""
+        logger.info("Warming up the model. It may take few minutes because of the cold start...")
+        self.invoker.invoke_model(prompt=self.prompt, max_tokens=self.max_tokens)
+
+    def measure(self, concurrency):
+        """
+        指定した同時実行数で step_duration 秒間リクエストを送り続けて計測
+
+        :param concurrency: 同時実行数
+        :return: 計測結果の辞書
+        """
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        deadline = time.monotonic() + self.step_duration
+
+        def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start_time = time.monotonic()
+                try:
+                    self.invoker.invoke_model(prompt=self.prompt, max_tokens=self.max_tokens)
+                    ok = True
+                except Exception:
+                    ok = False
+                latency = time.monotonic() - start_time
+                with lock:
+                    if ok:
+                        latencies.append(latency)
+                    else:
+                        errors += 1
+
+        start_time = time.monotonic()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start_time
+
+        total = len(latencies) + errors
+        good = [l for l in latencies if self.latency_slo is None or l <= self.latency_slo]
+        return {
+            'concurrency': concurrency,
+            'requests': total,
+            'error_rate': errors / total if total else 0.0,
+            'throughput': len(latencies) / elapsed,
+            'goodput': len(good) / elapsed,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99)
+        }
+
+    def _saturation_reason(self, result, baseline, best):
+        """飽和とみなす理由を返す（飽和していなければ None）"""
+        if result['error_rate'] > self.max_error_rate:
+            return f"error rate {result['error_rate']:.1%}"
+        if result['p99'] is None:
+            return "no successful requests"
+        if self.latency_slo is not None and result['p99'] > self.latency_slo:
+            return f"p99 {result['p99']:.3f}s exceeds SLO"
+        if baseline is not None and result['p99'] > baseline['p99'] * self.latency_factor:
+            return f"p99 {result['p99']:.3f}s exceeds {self.latency_factor}x baseline"
+        if best is not None and result['goodput'] < best['goodput'] * (1 + self.min_gain):
+            return f"goodput gain below {self.min_gain:.0%}"
+        return None
+
+    def _run_step(self, concurrency, baseline, best, history):
+        """1 段階を計測して記録し、飽和理由を返す"""
+        result = self.measure(concurrency)
+        reason = self._saturation_reason(result, baseline, best)
+        result['saturated'] = reason is not None
+        history.append(result)
+        logger.info(
+            f"concurrency={concurrency} goodput={result['goodput']:.2f} req/s "
+            f"p50={result['p50'] or 0:.3f}s p99={result['p99'] or 0:.3f}s "
+            f"errors={result['error_rate']:.1%}" + (f" -> saturated ({reason})" if reason else "")
+        )
+        return reason
+
+    def find_knee(self, start=1, max_concurrency=64, growth=2.0, refine_steps=2):
+        """
+        同時実行数を段階的に上げて飽和点を探す
+
+        :param start: 最初の同時実行数
+        :param max_concurrency: 試す同時実行数の上限
+        :param growth: 段階ごとに同時実行数を何倍にするか
+        :param refine_steps: 飽和点の前後を二分探索で詰める回数
+        :return: (飽和点の計測結果, 全段階の計測結果のリスト)
+        """
+        history = []
+        baseline = None
+        knee = None
+        saturated_at = None
+
+        # 粗く段階的に上げる
+        concurrency = start
+        while concurrency <= max_concurrency:
+            if self._run_step(concurrency, baseline, knee, history):
+                saturated_at = concurrency
+                break
+            knee = history[-1]
+            if baseline is None:
+                baseline = knee
+            concurrency = max(concurrency + 1, int(concurrency * growth))
+
+        # 飽和点の前後を二分探索で詰める
+        for _ in range(refine_steps):
+            if knee is None or saturated_at is None:
+                break
+            middle = (knee['concurrency'] + saturated_at) // 2
+            if middle <= knee['concurrency']:
+                break
+            if self._run_step(middle, baseline, knee, history):
+                saturated_at = middle
+            else:
+                knee = history[-1]
+
+        return knee, history
+
+
+def build_recommendation(knee, history, max_retries, model_arn):
+    """
+    飽和点の計測結果から推奨設定を作成
+
+    max_retries は計測していないため、明示的に指定された場合のみ書き出す
+    """
+    recommendation = {
+        'max_concurrency': knee['concurrency'],
+        'rate_limit': round(knee['goodput'], 2),
+        'model_arn': model_arn,
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'steps': history
+    }
+    if max_retries is not None:
+        recommendation['max_retries'] = max_retries
+    return recommendation
+
+
+def parse_arguments():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description='Find the concurrency knee of an imported model and write a recommended config'
+    )
+
+    parser.add_argument(
+        '--model-arn',
+        type=str,
+        default=None,
+        help='Imported Model ARN (required unless --stub is set)'
+    )
+
+    parser.add_argument(
+        '--region',
+        type=str,
+        default='us-west-2',
+        help='Region of imported model.'
+    )
+
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='concurrency_config.json',
+        help='Path to write the recommended config (default: concurrency_config.json)'
+    )
+
+    parser.add_argument(
+        '--max-concurrency',
+        type=int,
+        default=64,
+        help='Upper bound of concurrency to try (default: 64)'
+    )
+
+    parser.add_argument(
+        '--step-duration',
+        type=float,
+        default=60.0,
+        help='Seconds to measure at each concurrency level (default: 60)'
+    )
+
+    parser.add_argument(
+        '--latency-slo',
+        type=float,
+        default=None,
+        help='p99 latency SLO in seconds (optional)'
+    )
+
+    parser.add_argument(
+        '--max-tokens',
+        type=int,
+        default=256,
+        help='max_tokens of each request (default: 256)'
+    )
+
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=None,
+        help='max_retries to use and write to the recommended config (default: not written, 20 for tuning)'
+    )
+
+    parser.add_argument(
+        '--stub',
+        action='store_true',
+        help='Measure against a local stub runtime instead of Bedrock'
+    )
+
+    parser.add_argument(
+        '--stub-capacity',
+        type=int,
+        default=8,
+        help='Concurrent capacity of the stub runtime (default: 8)'
+    )
+
+    args = parser.parse_args()
+    if not args.stub and not args.model_arn:
+        parser.error('--model-arn is required unless --stub is set')
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    bedrock_runtime = None
+    if args.stub:
+        from stub_runtime import StubBedrockRuntime
+        bedrock_runtime = StubBedrockRuntime(capacity=args.stub_capacity)
+        logger.info(f"Using stub runtime with capacity {args.stub_capacity}")
+
+    invoker = BedrockModelInvoker(
+        {
+            'region_name': args.region,
+            'model_arn': args.model_arn or 'stub',
+            'max_retries': args.max_retries or 20
+        },
+        bedrock_runtime=bedrock_runtime
+    )
+    # 呼び出しごとのログを抑制
+    logging.getLogger('call_imported_model').setLevel(logging.WARNING)
+
+    tuner = ConcurrencyTuner(
+        invoker,
+        max_tokens=args.max_tokens,
+        step_duration=args.step_duration,
+        latency_slo=args.latency_slo
+    )
+    tuner.warm_up()
+    knee, history = tuner.find_knee(max_concurrency=args.max_concurrency)
+
+    if knee is None:
+        logger.error("The model was saturated even at the lowest concurrency. No config written.")
+        return
+
+    recommendation = build_recommendation(knee, history, args.max_retries, args.model_arn)
+    save_concurrency_config(args.output, recommendation)
+    logger.info(
+        f"Recommended max_concurrency={recommendation['max_concurrency']} "
+        f"rate_limit={recommendation['rate_limit']} req/s (written to {args.output})"
+    )
+
+
+if __name__ == "__main__":
+    main()